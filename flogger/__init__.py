@@ -1,2 +1,4 @@
-from .logger import DataLogger
-from .handlers import *
\ No newline at end of file
+from .logger import DataLogger, LoggerNamespace
+from .handlers import *
+from .tsb import EventFileWriter
+from .supervision import Supervised
\ No newline at end of file
@@ -9,14 +9,158 @@ This module contains handlers for the DataLogger class.
 import sys
 import os
 import logging
-import tensorboardX
 import imageio
 import numpy as np
 import json
+import io
+import zlib
+import threading
+import multiprocessing
+import atexit
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
 from pprint import pformat
 import matplotlib
 matplotlib.use('agg')
 import matplotlib.pyplot as plt
+from .tsb import get_event_file_writer, flush_event_files
+
+
+###########
+# HELPERS #
+###########
+# Per-process caches of the image handlers. Those are filled in the process (or thread) running the handler, and only
+# keep the last `_MAX_CACHED` paths.
+_MAX_CACHED = 64
+_encoded_images = OrderedDict()
+_montages = OrderedDict()
+_caches_lock = threading.Lock()
+# Process pools used to encode images, by number of processes.
+_encoding_pools = {}
+_encoding_pools_lock = threading.Lock()
+
+
+def _cache_get(cache, key):
+    """Returns a cached item, or None, and marks it as the most recently used."""
+    with _caches_lock:
+        value = cache.get(key)
+        if value is not None:
+            cache.move_to_end(key)
+        return value
+
+
+def _cache_set(cache, key, value):
+    """Caches an item, evicting the least recently used ones beyond `_MAX_CACHED` items."""
+    with _caches_lock:
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > _MAX_CACHED:
+            cache.popitem(last=False)
+
+
+def clear_image_caches(path=None):
+    """Drops the state kept by `save_to_images` and `save_to_montage` in the current process.
+
+    :param string or None path: Only drops the state of the files under this root path. If `None`, drops everything.
+    """
+    with _caches_lock:
+        for cache in [_encoded_images, _montages]:
+            for key in list(cache.keys()):
+                if path is None or key == path or key.startswith(os.path.join(path, "")):
+                    del cache[key]
+
+
+def _temporary_path(filename):
+    """Returns the path of the temporary file used to write `filename`. It is hidden, and keeps the extension last, so
+    that writers can infer the format from it."""
+    directory, name = os.path.split(filename)
+    stem, extension = os.path.splitext(name)
+    return os.path.join(directory, ".{}.{}-{}.tmp{}".format(stem, os.getpid(), threading.get_ident(), extension))
+
+
+def _remove_temporary_files(directory, pid):
+    """Removes the temporary files left in a directory by a process, for instance after it was killed."""
+    if os.path.isdir(directory):
+        for name in os.listdir(directory):
+            if name.startswith(".") and ".{}-".format(pid) in name and ".tmp" in name:
+                os.remove(os.path.join(directory, name))
+
+
+def _write_atomic(filename, content):
+    """Writes bytes to a file through a temporary file, renamed over `filename` once complete. Nothing is written if
+    the file already holds the same bytes."""
+    if os.path.exists(filename) and os.path.getsize(filename) == len(content):
+        with open(filename, "rb") as fp:
+            if fp.read() == content:
+                return
+    tmp_path = _temporary_path(filename)
+    try:
+        with open(tmp_path, "wb") as fp:
+            fp.write(content)
+        os.replace(tmp_path, filename)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+@contextmanager
+def _atomic_path(filename):
+    """Yields a temporary path to write a file to. When the block completes, the temporary file replaces `filename` in
+    a single rename. If the block fails, the temporary file is removed. Used by the writers that need an actual file,
+    for which the content is not compared, to avoid reading both files back."""
+    tmp_path = _temporary_path(filename)
+    try:
+        yield tmp_path
+        os.replace(tmp_path, filename)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _get_encoding_pool(n_par):
+    """Returns the process pool of `n_par` processes used to encode images, creating it at first call. Returns `None`
+    when called from a child process, for instance a worker of a process based DataLogger, to avoid starting a pool of
+    processes in every worker."""
+    if multiprocessing.current_process().name != "MainProcess":
+        return None
+    with _encoding_pools_lock:
+        if n_par not in _encoding_pools:
+            _encoding_pools[n_par] = ProcessPoolExecutor(max_workers=n_par)
+        return _encoding_pools[n_par]
+
+
+@atexit.register
+def _shutdown_encoding_pools():
+    """Shuts the encoding pools down at exit."""
+    with _encoding_pools_lock:
+        for pool in _encoding_pools.values():
+            pool.shutdown(wait=True)
+        _encoding_pools.clear()
+
+
+def _fingerprint(value):
+    """Returns a cheap checksum of an image, to detect that it changed."""
+    value = np.ascontiguousarray(value)
+    return value.shape, value.dtype.str, zlib.crc32(value.view(np.uint8))
+
+
+def _to_hwc(value):
+    """Turns an image of shape [C, W, H] into an image of shape [W, H, C], or [W, H] for a single channel."""
+    image = np.moveaxis(np.asarray(value), 0, -1)
+    if image.shape[-1] == 1:
+        image = image[..., 0]
+    return image
+
+
+def _write_image(filename, image, fmt, quality=None):
+    """Encodes an image to a file. The quality is only given to lossy formats."""
+    kwargs = {}
+    if quality is not None and fmt.lower() in ["jpg", "jpeg", "webp"]:
+        kwargs["quality"] = quality
+    _write_atomic(filename, imageio.imwrite("<bytes>", image, format=fmt, **kwargs))
 
 
 ############
@@ -92,41 +236,72 @@ def log_critical_last(entry, data, **kwargs):
     logging.getLogger("datalogger").critical("{} at {}: {}".format(entry, last_time, value))
 
 
-def add_tsb_scalar_last(entry, data, subfolder="", path=".", **kwargs):
+def add_tsb_scalar_last(entry, data, subfolder="", backend="tensorboardX", path=".", **kwargs):
     """Handler that appends the last item of the data dictionary to a tensorboard event file.
 
     :param string entry: Name of the log entry
     :param Dict data: Data should be a number
     :param string subfolder: Subfolder in which put the data
+    :param string backend: Either "tensorboardX", or "builtin" to use the lightweight writer of `flogger.tsb`. The
+    builtin writer buffers the scalars and writes them by batches (see `flush_tsb_scalars`).
     :param string path: Root path. Set by DataLogger if used as handler.
     """
 
     tsb_dir = os.path.join(path, subfolder)
-    os.makedirs(tsb_dir, exist_ok=True)
-    tsb_writer = tensorboardX.SummaryWriter(log_dir=tsb_dir)
     last_time = max(data.keys())
     value = data[last_time]
-    tsb_writer.add_scalar(entry, value, last_time)
-
-
-def add_tsb_scalars_last(entry, data, labels=None, path=".", subfolder="", **kwargs):
+    if backend == "builtin":
+        get_event_file_writer(tsb_dir).add_scalar(entry, value, last_time)
+    elif backend == "tensorboardX":
+        import tensorboardX
+        os.makedirs(tsb_dir, exist_ok=True)
+        tsb_writer = tensorboardX.SummaryWriter(log_dir=tsb_dir)
+        tsb_writer.add_scalar(entry, value, last_time)
+    else:
+        raise Exception(f"Unknown tensorboard backend `{backend}`")
+
+
+def add_tsb_scalars_last(entry, data, labels=None, path=".", subfolder="", backend="tensorboardX", **kwargs):
     """Handler that appends the last item of the data dictionary to a tensorboard event file.
 
     :param string entry: Name of the log entry.
     :param Dict data: Data should be numpy arrays of size [n] with constant n.
     :param List[string] labels: Labels to use for the lines
     :param string subfolder: Subfolder in which put the data
+    :param string backend: Either "tensorboardX", or "builtin" to use the lightweight writer of `flogger.tsb`. The
+    builtin writer buffers the scalars and writes them by batches (see `flush_tsb_scalars`).
     :param string path: Root path. Set by DataLogger if used as handler.
     """
     tsb_dir = os.path.join(path, subfolder)
-    os.makedirs(tsb_dir, exist_ok=True)
-    tsb_writer = tensorboardX.SummaryWriter(log_dir=tsb_dir)
     last_time = max(data.keys())
     value = data[last_time]
     if labels is None:
         labels = [str(a) for a in range(len(value))]
-    scalars_dict = {labels[i]: value[i] for i in range(len(value))}
-    tsb_writer.add_scalars(entry, scalars_dict, last_time)
+    if backend == "builtin":
+        # Same layout as tensorboardX: one directory per label, all sharing the entry as tag.
+        for i in range(len(value)):
+            get_event_file_writer(os.path.join(tsb_dir, entry, labels[i])).add_scalar(entry, value[i], last_time)
+    elif backend == "tensorboardX":
+        import tensorboardX
+        os.makedirs(tsb_dir, exist_ok=True)
+        tsb_writer = tensorboardX.SummaryWriter(log_dir=tsb_dir)
+        scalars_dict = {labels[i]: value[i] for i in range(len(value))}
+        tsb_writer.add_scalars(entry, scalars_dict, last_time)
+    else:
+        raise Exception(f"Unknown tensorboard backend `{backend}`")
+
+
+def flush_tsb_scalars(entry, data, **kwargs):
+    """Handler that writes the scalars buffered by the builtin tensorboard backend, in the process running it.
+
+    Buffered scalars are written once 100 of them are pending in a directory, when a scalar is added a second after the
+    oldest pending one, and at exit. Use this handler, e.g. on dump, to make them visible earlier. With a process based
+    pool, only the buffers of the process running the handler are written.
+
+    :param string entry: Name of the log entry.
+    :param Dict data: Unused.
+    """
+    flush_event_files()
 
 
 def add_tsb_image_last(entry, data, path=".", subfolder="", **kwargs):
@@ -137,6 +312,7 @@ def add_tsb_image_last(entry, data, path=".", subfolder="", **kwargs):
     :param string subfolder: Subfolder in which put the data
     :param string path: Root path. Set by DataLogger if used as handler.
     """
+    import tensorboardX
     tsb_dir = os.path.join(path, subfolder)
     os.makedirs(tsb_dir, exist_ok=True)
     tsb_writer = tensorboardX.SummaryWriter(log_dir=tsb_dir)
@@ -155,10 +331,11 @@ def save_to_gif(entry, data, path=".", **kwargs):
     values = [data[i] for i in sorted(data.keys())]
     path = os.path.join(path, entry)
     os.makedirs(os.path.dirname(path), exist_ok=True)
-    writer = imageio.get_writer("{}.gif".format(path), fps=5)
-    for frame in values:
-        writer.append_data(frame)
-    writer.close()
+    with _atomic_path("{}.gif".format(path)) as tmp_path:
+        writer = imageio.get_writer(tmp_path, fps=5)
+        for frame in values:
+            writer.append_data(frame)
+        writer.close()
 
 
 def save_to_gif_last(entry, data, fps=5, path=".", **kwargs):
@@ -173,10 +350,11 @@ def save_to_gif_last(entry, data, fps=5, path=".", **kwargs):
     value = data[last_time]
     path = os.path.join(path, entry)
     os.makedirs(os.path.dirname(path), exist_ok=True)
-    writer = imageio.get_writer("{}.gif".format(path), fps=fps)
-    for frame in value:
-        writer.append_data(np.moveaxis(frame, 0, -1))
-    writer.close()
+    with _atomic_path("{}.gif".format(path)) as tmp_path:
+        writer = imageio.get_writer(tmp_path, fps=fps)
+        for frame in value:
+            writer.append_data(np.moveaxis(frame, 0, -1))
+        writer.close()
 
 
 def save_to_jpg(entry, data, path=".", **kwargs):
@@ -191,7 +369,7 @@ def save_to_jpg(entry, data, path=".", **kwargs):
     image = np.moveaxis(image, 0, -1)
     path = os.path.join(path, entry)
     os.makedirs(os.path.dirname(path), exist_ok=True)
-    imageio.imwrite("{}.jpg".format(path), image)
+    _write_atomic("{}.jpg".format(path), imageio.imwrite("<bytes>", image, format="jpg"))
 
 
 def save_to_jpg_last(entry, data, path=".", **kwargs):
@@ -201,9 +379,110 @@ def save_to_jpg_last(entry, data, path=".", **kwargs):
     :param Dict data: Data should be a numpy array of shape [3, W, H] or of shape [1, W, H]
     :param string path: Root path. Set by DataLogger if used as handler.
     """
+    last_time = max(data.keys())
+    value = data[last_time]
+    path = os.path.join(path, entry)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    _write_atomic("{}.jpg".format(path), imageio.imwrite("<bytes>", _to_hwc(value), format="jpg"))
+
+
+def save_to_images(entry, data, fmt="png", quality=None, n_par=4, parallel_threshold=16, path=".", **kwargs):
+    """Handler that stores every image of the data dictionary to its own file, named after its key, in a folder named
+    after the log entry.
+
+    Only the images that are new or changed since the previous call are encoded, changes being detected with a checksum
+    of the images. When many images have to be encoded at once, the encoding is spread over a pool of `n_par`
+    processes, shared by all calls with the same `n_par`. If the handler already runs in a child process, as with
+    `set_pool("process", n)`, the images are encoded sequentially, the logger pool already providing the parallelism.
+
+    :param string entry: Name of the log entry.
+    :param Dict data: Data should be a numpy array of shape [3, W, H] or of shape [1, W, H]
+    :param string fmt: Image format, e.g. "png", "webp" or "jpg".
+    :param int or None quality: Encoding quality (1-100) for lossy formats. Ignored for "png".
+    :param int n_par: Number of processes used to encode large batches.
+    :param int parallel_threshold: Minimum number of new images for the encoding to be made in parallel.
+    :param string path: Root path. Set by DataLogger if used as handler.
+    """
+    path = os.path.join(path, entry)
+    os.makedirs(path, exist_ok=True)
+    items = list(data.items())
+    encoded = _cache_get(_encoded_images, path)
+    if encoded is None:
+        encoded = {}
+        _cache_set(_encoded_images, path, encoded)
+    fingerprints = {key: _fingerprint(value) for key, value in items}
+    jobs = [("{}.{}".format(os.path.join(path, str(key)), fmt), _to_hwc(value))
+            for key, value in sorted(items, key=lambda item: item[0]) if encoded.get(key) != fingerprints[key]]
+    pool = _get_encoding_pool(n_par) if n_par > 1 and len(jobs) >= parallel_threshold else None
+    if pool is not None:
+        futures = [pool.submit(_write_image, filename, image, fmt, quality) for filename, image in jobs]
+        for future in futures:
+            future.result()
+    else:
+        for filename, image in jobs:
+            _write_image(filename, image, fmt, quality)
+    encoded.clear()
+    encoded.update(fingerprints)
+
+
+def save_to_montage(entry, data, ncols=8, fmt="png", quality=None, path=".", **kwargs):
+    """Handler that stores all images of the data dictionary to a grid montage, ordered by keys.
+
+    The montage is kept in a preallocated canvas between calls, so that only the images that are new or changed since
+    the previous call, changes being detected with a checksum of the images, are copied in it.
+
+    :param string entry: Name of the log entry.
+    :param Dict data: Data should be a numpy array of shape [3, W, H] or of shape [1, W, H], of constant shape.
+    :param int ncols: Number of images per row of the montage.
+    :param string fmt: Image format, e.g. "png", "webp" or "jpg".
+    :param int or None quality: Encoding quality (1-100) for lossy formats. Ignored for "png".
+    :param string path: Root path. Set by DataLogger if used as handler.
+    """
     path = os.path.join(path, entry)
     os.makedirs(os.path.dirname(path), exist_ok=True)
-    imageio.imwrite("{}.jpg".format(os.path.join(path, entry)), list(data.values())[-1])
+    filename = "{}.{}".format(path, fmt)
+    items = sorted(data.items(), key=lambda item: item[0])
+    if not items:
+        return
+    montage = _cache_get(_montages, filename)
+    if montage is None or montage["ncols"] != ncols:
+        montage = {"ncols": ncols, "tiles": [], "canvas": None, "tile_shape": None}
+        _cache_set(_montages, filename, montage)
+    # Key and checksum of the image copied at each position of the canvas.
+    tiles = montage["tiles"]
+    for index, (key, value) in enumerate(items):
+        tile_id = (key, _fingerprint(value))
+        if index < len(tiles) and tiles[index] == tile_id:
+            continue
+        tile = _to_hwc(value)
+        canvas = montage["canvas"]
+        if index == 0 and (canvas is None or tile.shape != montage["tile_shape"] or tile.dtype != canvas.dtype):
+            # First call, or the images changed of shape: the montage is rebuilt.
+            n_rows = -(-len(items) // ncols)
+            canvas = np.zeros((n_rows * tile.shape[0], ncols * tile.shape[1]) + tile.shape[2:], dtype=tile.dtype)
+            montage["tile_shape"] = tile.shape
+            del tiles[:]
+        elif tile.shape != montage["tile_shape"] or tile.dtype != canvas.dtype:
+            raise Exception(f"Image {key} of {entry} is a {tile.dtype} image of shape {tile.shape}, while the montage "
+                            f"holds {canvas.dtype} images of shape {montage['tile_shape']}.")
+        height, width = tile.shape[:2]
+        row, col = divmod(index, ncols)
+        if (row + 1) * height > canvas.shape[0]:
+            # Grows the canvas geometrically to amortize the reallocations.
+            grown = np.zeros((2 * canvas.shape[0],) + canvas.shape[1:], dtype=canvas.dtype)
+            grown[:canvas.shape[0]] = canvas
+            canvas = grown
+        canvas[row * height:(row + 1) * height, col * width:(col + 1) * width] = tile
+        montage["canvas"] = canvas
+        if index < len(tiles):
+            tiles[index] = tile_id
+        else:
+            tiles.append(tile_id)
+    # Images beyond the data were dropped by a reset, and will be overwritten.
+    del tiles[len(items):]
+    height, width = montage["tile_shape"][:2]
+    image = montage["canvas"][:-(-len(items) // ncols) * height, :min(len(items), ncols) * width]
+    _write_image(filename, image, fmt, quality)
 
 
 def save_to_mp4(entry, data, fps=5, path=".", **kwargs):
@@ -217,10 +496,11 @@ def save_to_mp4(entry, data, fps=5, path=".", **kwargs):
     values = [data[i] for i in sorted(data.keys())]
     path = os.path.join(path, entry)
     os.makedirs(os.path.dirname(path), exist_ok=True)
-    writer = imageio.get_writer("{}.mp4".format(path), fps=fps)
-    for frame in values:
-        writer.append_data(np.moveaxis(frame, 0, -1))
-    writer.close()
+    with _atomic_path("{}.mp4".format(path)) as tmp_path:
+        writer = imageio.get_writer(tmp_path, fps=fps)
+        for frame in values:
+            writer.append_data(np.moveaxis(frame, 0, -1))
+        writer.close()
 
 
 def save_to_mp4_last(entry, data, fps=5, path=".", **kwargs):
@@ -235,10 +515,11 @@ def save_to_mp4_last(entry, data, fps=5, path=".", **kwargs):
     value = data[last_time]
     path = os.path.join(path, entry)
     os.makedirs(os.path.dirname(path), exist_ok=True)
-    writer = imageio.get_writer("{}.mp4".format(path), fps=fps)
-    for frame in value:
-        writer.append_data(np.moveaxis(frame, 0, -1))
-    writer.close()
+    with _atomic_path("{}.mp4".format(path)) as tmp_path:
+        writer = imageio.get_writer(tmp_path, fps=fps)
+        for frame in value:
+            writer.append_data(np.moveaxis(frame, 0, -1))
+        writer.close()
 
 
 def save_to_json(entry, data, path=".", **kwargs):
@@ -250,8 +531,7 @@ def save_to_json(entry, data, path=".", **kwargs):
     """
     path = os.path.join(path, entry)
     os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open('{}.json'.format(path), 'w') as fp:
-        json.dump(dict(data), fp)
+    _write_atomic('{}.json'.format(path), json.dumps(dict(data)).encode("utf-8"))
 
 
 def save_to_json_last(entry, data, path=".", **kwargs):
@@ -265,8 +545,7 @@ def save_to_json_last(entry, data, path=".", **kwargs):
     value = data[last_time]
     path = os.path.join(path, entry)
     os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open('{}.json'.format(path), 'w') as fp:
-        json.dump(value, fp)
+    _write_atomic('{}.json'.format(path), json.dumps(value).encode("utf-8"))
 
 
 def save_to_text_last(entry, data, path=".", **kwargs):
@@ -280,8 +559,7 @@ def save_to_text_last(entry, data, path=".", **kwargs):
     value = pformat(data[last_time])
     path = os.path.join(path, entry)
     os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open('{}.txt'.format(path), 'w') as fp:
-        fp.write(value)
+    _write_atomic('{}.txt'.format(path), value.encode("utf-8"))
 
 
 def save_to_text(entry, data, path=".", **kwargs):
@@ -294,8 +572,7 @@ def save_to_text(entry, data, path=".", **kwargs):
     value = pformat(data)
     path = os.path.join(path, entry)
     os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open('{}.txt'.format(path), 'w') as fp:
-        fp.write(value)
+    _write_atomic('{}.txt'.format(path), value.encode("utf-8"))
 
 
 def save_to_mpl_lines(entry, data, labels=None, path=".", **kwargs):
@@ -314,7 +591,9 @@ def save_to_mpl_lines(entry, data, labels=None, path=".", **kwargs):
     plt.title(entry)
     path = os.path.join(path, entry)
     os.makedirs(os.path.dirname(path), exist_ok=True)
-    plt.savefig("{}.png".format(path))
+    buffer = io.BytesIO()
+    plt.savefig(buffer, format="png")
+    _write_atomic("{}.png".format(path), buffer.getvalue())
     plt.close(fig)
 
 
@@ -337,5 +616,7 @@ def save_to_mpl_histolines(entry, data, color="navy", path=".", **kwargs):
     plt.title(entry)
     path = os.path.join(path, entry)
     os.makedirs(os.path.dirname(path), exist_ok=True)
-    plt.savefig("{}.png".format(path))
+    buffer = io.BytesIO()
+    plt.savefig(buffer, format="png")
+    _write_atomic("{}.png".format(path), buffer.getvalue())
     plt.close(fig)
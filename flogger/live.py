@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+This module contains a live tail facility, which keeps the last pushed records of a logger in memory and serves them
+over a local HTTP server. Dashboards can then follow a run by asking, for an entry, the records pushed since a cursor,
+without reading the files written by the handlers.
+"""
+###########
+# IMPORTS #
+###########
+import json
+import math
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from itertools import islice
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+
+
+#############
+# LIVE TAIL #
+#############
+class LiveTail(object):
+    """Keeps the last records pushed in each entry, indexed by a per-entry cursor.
+
+    The cursor of a record is its position in the stream of records pushed in the entry. Records are serialized to json
+    lines when appended, so that later in place modifications of the pushed values do not show up. Only the last
+    `capacity` records of each entry are kept, within `max_bytes` bytes per entry.
+
+    :param int capacity: Number of records kept per entry.
+    :param int max_bytes: Size of the records kept per entry, in bytes. The last record is always kept.
+    :param List[string] or None entries: Names of the entries to keep records of. If `None`, all the entries.
+    """
+
+    def __init__(self, capacity=10000, max_bytes=16 * 2 ** 20, entries=None):
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self.filter = None if entries is None else set(entries)
+        self._records = dict()
+        self._sizes = dict()
+        self._cursors = dict()
+        self._condition = threading.Condition()
+
+    def declare(self, entry):
+        """Starts keeping the records of an entry, unless it is filtered out.
+
+        :param string entry: Name of the log entry.
+        """
+        if self.filter is not None and entry not in self.filter:
+            return
+        with self._condition:
+            if entry not in self._records:
+                self._records[entry] = deque()
+                self._sizes[entry] = 0
+                self._cursors[entry] = 0
+
+    def append(self, entry, time, value):
+        """Appends a record to an entry, and wakes up the pending requests. Records of entries that were not declared
+        are ignored.
+
+        :param string entry: Name of the log entry.
+        :param int time: Date of the record.
+        :param Any value: Value of the record.
+        """
+        if entry not in self._records:
+            return
+        # Serialized without the cursor, which is only known once the lock is held.
+        fields = json.dumps({"time": time, "value": value}, default=_to_json)[1:]
+        with self._condition:
+            cursor = self._cursors[entry]
+            line = '{{"cursor": {}, {}\n'.format(cursor, fields).encode("utf-8")
+            records = self._records[entry]
+            records.append((cursor, line))
+            self._sizes[entry] += len(line)
+            while len(records) > 1 and (len(records) > self.capacity or self._sizes[entry] > self.max_bytes):
+                self._sizes[entry] -= len(records.popleft()[1])
+            self._cursors[entry] = cursor + 1
+            self._condition.notify_all()
+
+    def entries(self):
+        """Returns the entries along with their next cursor.
+
+        :return: Next cursor of each entry.
+        :rtype: Dict[string, int]
+        """
+        with self._condition:
+            return dict(self._cursors)
+
+    def since(self, entry, cursor, timeout=0.):
+        """Returns the records of an entry from a cursor, waiting at most `timeout` seconds for one to be pushed.
+
+        :param string entry: Name of the log entry.
+        :param int cursor: Cursor of the first record to return.
+        :param float timeout: Maximum time to wait for a record, in seconds.
+        :return: The records, as json lines, and the cursor to use for the next call.
+        :rtype: Tuple[List[bytes], int]
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._cursors[entry] > cursor, timeout=timeout)
+            records = self._records[entry]
+            first = self._cursors[entry] - len(records)
+            return [line for _, line in islice(records, max(cursor - first, 0), None)], self._cursors[entry]
+
+
+##########
+# SERVER #
+##########
+def _to_json(value):
+    """Makes numpy values json serializable."""
+    if isinstance(value, (np.ndarray, np.generic)):
+        return value.tolist()
+    return repr(value)
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    """HTTP server handling each request in a thread (`http.server.ThreadingHTTPServer` only exists from python 3.7)."""
+    daemon_threads = True
+
+
+class _LiveTailRequestHandler(BaseHTTPRequestHandler):
+    """Serves the records of a live tail.
+
+    + `GET /entries` returns the entries and their next cursor, as json.
+    + `GET /tail?entry=<entry>&cursor=<cursor>&timeout=<seconds>` returns the records pushed since the cursor, as
+      newline delimited json. The request is held until a record is available or the timeout expires. The cursor to use
+      for the next request is given in the `X-Cursor` header.
+    """
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        tail = self.server.tail
+        if url.path == "/entries":
+            body = json.dumps(tail.entries()).encode("utf-8")
+            next_cursor = None
+            content_type = "application/json"
+        elif url.path == "/tail":
+            entry = query.get("entry", [None])[0]
+            if entry not in tail.entries():
+                self.send_error(404, f"Unknown entry `{entry}`")
+                return
+            try:
+                cursor = int(query.get("cursor", [0])[0])
+                timeout = float(query.get("timeout", [0])[0])
+            except ValueError as e:
+                self.send_error(400, str(e))
+                return
+            if not math.isfinite(timeout) or timeout < 0:
+                self.send_error(400, f"Timeout {timeout} must be a finite positive number")
+                return
+            lines, next_cursor = tail.since(entry, cursor, min(timeout, self.server.max_timeout))
+            body = b"".join(lines)
+            content_type = "application/x-ndjson"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if next_cursor is not None:
+            self.send_header("X-Cursor", str(next_cursor))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_live_tail(tail, host="127.0.0.1", port=0, max_timeout=30.):
+    """Starts serving a live tail from a daemon thread.
+
+    :param LiveTail tail: The live tail to serve.
+    :param string host: Address to bind. Defaults to the loopback interface.
+    :param int port: Port to bind. If 0, a free port is picked.
+    :param float max_timeout: Maximum time a request can be held, in seconds.
+    :return: The running server. Its address is given by `server.server_address`.
+    :rtype: HTTPServer
+    """
+    server = _ThreadingHTTPServer((host, port), _LiveTailRequestHandler)
+    server.tail = tail
+    server.max_timeout = max_timeout
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -16,7 +16,10 @@ from threading import Lock
 from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future, wait
 import datetime
 import time
+import random
 import logging
+from .live import LiveTail, serve_live_tail
+from .handlers import clear_image_caches
 logging.basicConfig(level=logging.INFO,
                     format="[%(asctime)s] %(levelname)s [%(module)s:%(funcName)s:%(lineno)d] %(message)s")
 
@@ -36,11 +39,62 @@ class Singleton(type):
         return cls._instances[cls]
 
 
-###############
-# DATA LOGGER #
-###############
-class DataLogger(metaclass=Singleton):
-    """Stores and save various type of data under various forms."""
+###################
+# SAMPLING POLICY #
+###################
+class SamplingPolicy(object):
+    """Decides, in the calling thread, whether a pushed value is handled or dropped.
+
+    A value is accepted if it is the first of every `every` pushes, if it passes a random draw with probability
+    `probability`, and if the last accepted value is older than `1 / max_rate` seconds. The check does not touch the
+    managed resources, so that dropping a value costs next to nothing.
+
+    :param int or None every: Accept one push every `every` pushes.
+    :param float or None max_rate: Maximum number of accepted pushes per second.
+    :param float or None probability: Probability to accept a push.
+    """
+    __slots__ = ["every", "min_interval", "probability", "_calls", "_last"]
+
+    def __init__(self, every=None, max_rate=None, probability=None):
+        assert every is None or every >= 1, f"Every {every} must be at least 1."
+        assert max_rate is None or max_rate > 0, f"Max rate {max_rate} must be positive."
+        assert probability is None or 0 <= probability <= 1, f"Probability {probability} must be in [0, 1]."
+        self.every = every
+        self.min_interval = 1. / max_rate if max_rate is not None else None
+        self.probability = probability
+        self._calls = 0
+        self._last = None
+
+    def accept(self):
+        """Returns whether the current push should be handled."""
+        calls = self._calls
+        self._calls = calls + 1
+        if self.every is not None and calls % self.every != 0:
+            return False
+        if self.probability is not None and random.random() >= self.probability:
+            return False
+        if self.min_interval is not None:
+            now = time.monotonic()
+            if self._last is not None and now - self._last < self.min_interval:
+                return False
+            self._last = now
+        return True
+
+
+####################
+# LOGGER NAMESPACE #
+####################
+class LoggerNamespace(object):
+    """Stores and save various type of data under various forms, in an independent set of entries.
+
+    Namespaces are not meant to be instantiated directly, but through `DataLogger.namespace`. They have their own name,
+    path and entries, but share the executor and the storage backend of the data logger.
+
+    :param string name: Name of the namespace.
+    :param string path: Root path of the namespace.
+    :param DataLogger or None root: The data logger owning the executor and the storage backend. If `None`, the
+    instance must own those itself.
+    """
 
     @staticmethod
     def _futures_callback(future: Future):
@@ -82,14 +136,15 @@ class DataLogger(metaclass=Singleton):
             managed.data[entry].clear()
             managed.counters[entry] = 0
 
-    def __init__(self):
+    def __init__(self, name="data-logger", path=".", root=None):
         # Init and set attributes
-        super(DataLogger, self).__init__()
+        super(LoggerNamespace, self).__init__()
+        self._root = root if root is not None else self
+        self._manager = self._root._manager
         # Managed resources (accessible by remote threads or remote processes)
-        self._manager = Manager()
         self._managed = self._manager.Namespace()
-        self._managed.name = "data-logger"
-        self._managed.path = "."
+        self._managed.name = name
+        self._managed.path = path
         self._managed.entries = self._manager.list()
         self._managed.data = self._manager.dict()
         self._managed.lockers = self._manager.dict()
@@ -97,11 +152,19 @@ class DataLogger(metaclass=Singleton):
         self._managed.on_push_callables = self._manager.dict()
         self._managed.on_reset_callables = self._manager.dict()
         self._managed.on_dump_callables = self._manager.dict()
+        os.makedirs(path, exist_ok=True)
 
         self._tick = datetime.datetime.now()
-        self._futures = list()
-        self._pool = ThreadPoolExecutor(max_workers=1)
+        # Futures not completed yet, by entry. Completed futures are dropped by their done callback.
+        self._pending = dict()
         self._mode = "active"
+        # Sampling policies are local to the calling process, and checked before anything is submitted.
+        self._policies = dict()
+        # Live tail, only set when serving.
+        self._tail = None
+        self._server = None
+        # Set when the namespace is closed by the data logger.
+        self._closed = False
 
         # Log
         logging.getLogger("datalogger").info("{} DataLogger initialized!".format(self._managed.name))
@@ -137,21 +200,6 @@ class DataLogger(metaclass=Singleton):
         """
         return self._managed.path
 
-    def set_pool(self, pool, n_par=5):
-        """Sets the executor to be used to call handlers.
-
-        :param string pool: The type of executor to use to call handlers. Either "thread" or "process".
-        :param int n_par: The number of executor to use.
-        """
-        if len(self._managed.lockers) != 0:
-            raise Exception("You tried to pool after having registered some entries.")
-        if pool == "thread":
-            self._pool = ThreadPoolExecutor(max_workers=n_par)
-        elif pool == "process":
-            self._pool = ProcessPoolExecutor(max_workers=n_par)
-        else:
-            raise Exception(f"Unknown pool type `{pool}`")
-
     def set_name(self, name):
         """Sets the name of the logger.
 
@@ -159,19 +207,29 @@ class DataLogger(metaclass=Singleton):
         """
         self._managed.name = name
 
-    def declare(self, entry, on_push_callables, on_dump_callables, on_reset_callables):
+    def declare(self, entry, on_push_callables, on_dump_callables, on_reset_callables, every=None, max_rate=None,
+                probability=None):
         """Register a recurring log entry.
 
         Registering an entry gives access to the `push`, `reset` and `dump` methods. Note that all the handlers must be
         able to handle the data that will be pushed.
 
+        The `every`, `max_rate` and `probability` arguments set a sampling policy on the pushes of the entry. Pushes
+        rejected by the policy are dropped in the calling thread, before any task is submitted to the executor.
+
         :param string entry: Name of the log entry.
         :param List[handlers] on_push_callables: Handlers called on data when `push` is called.
         :param List[handlers] on_reset_callables: Handlers called on data when `reset` is called.
         :param List[handlers] on_dump_callables: Handlers called on the data when `dump` is called.
+        :param int or None every: Only keep one push every `every` pushes.
+        :param float or None max_rate: Only keep at most `max_rate` pushes per second.
+        :param float or None probability: Only keep pushes with probability `probability`.
         """
+        self._check_open()
         if entry in self._managed.entries:
             raise Exception("You tried to declare an existing log entry")
+        if every is not None or max_rate is not None or probability is not None:
+            self._policies[entry] = SamplingPolicy(every, max_rate, probability)
         self._managed.entries.append(entry)
         self._managed.lockers[entry] = self._manager.RLock()
         self._managed.data[entry] = self._manager.dict()
@@ -181,36 +239,58 @@ class DataLogger(metaclass=Singleton):
         self._managed.on_dump_callables[entry] = self._manager.list(on_dump_callables)
         if os.path.dirname(entry) != "":
             os.makedirs(os.path.join(self._managed.path, os.path.dirname(entry)), exist_ok=True)
+        if self._tail is not None:
+            self._tail.declare(entry)
+
+    def _check_open(self):
+        """Raises if the namespace was closed."""
+        if self._closed:
+            raise Exception(f"You tried to use the logger namespace `{self._managed.name}` after it was closed.")
+
+    def _track(self, entry, future):
+        """Tracks a future of an entry until its completion."""
+        future.add_done_callback(LoggerNamespace._futures_callback)
+        pending = self._pending.setdefault(entry, set())
+        pending.add(future)
+        future.add_done_callback(pending.discard)
 
     def push(self, entry, value, time=None):
         """Append data to a recurring log.
 
-        All handlers registered for the `on_push` event will be called.
+        All handlers registered for the `on_push` event will be called, unless the push is dropped by the sampling
+        policy of the entry.
 
         :param string entry: Name of the log entry
         :param Any value: Object containing the data to log. Should be of same type from call to call...
         :param int or None time: Date of the logging (epoch, iteration, tic ...). Will be used as key in the data
         dictionary. If `None`, the last data key plus one will be used.
         """
+        self._check_open()
         if self._mode == "active":
-            future = self._pool.submit(DataLogger._push,
-                                       self._managed,
-                                       entry,
-                                       value,
-                                       time if time is not None else self._managed.counters[entry])
-            future.add_done_callback(DataLogger._futures_callback)
-            self._futures.append(future)
+            policy = self._policies.get(entry)
+            if policy is not None and not policy.accept():
+                return
+            if time is None:
+                time = self._managed.counters[entry]
+            if self._tail is not None:
+                self._tail.append(entry, time, value)
+            future = self._root._pool.submit(LoggerNamespace._push,
+                                            self._managed,
+                                            entry,
+                                            value,
+                                            time)
+            self._track(entry, future)
 
     def dump(self):
         """Calls handlers declared for `on_dump` event, for all registered log entries.
         """
+        self._check_open()
         if self._mode == "active":
             for entry in self._managed.entries:
-                future = self._pool.submit(DataLogger._dump,
-                                           self._managed,
-                                           entry)
-                future.add_done_callback(DataLogger._futures_callback)
-                self._futures.append(future)
+                future = self._root._pool.submit(LoggerNamespace._dump,
+                                                self._managed,
+                                                entry)
+                self._track(entry, future)
 
     def reset(self, entry):
         """Resets the data of a recurring log entry.
@@ -219,12 +299,48 @@ class DataLogger(metaclass=Singleton):
 
         :param string entry: name of the log entry.
         """
+        self._check_open()
         if self._mode == "active":
-            future = self._pool.submit(DataLogger._reset,
-                                       self._managed,
-                                       entry)
-            future.add_done_callback(DataLogger._futures_callback)
-            self._futures.append(future)
+            future = self._root._pool.submit(LoggerNamespace._reset,
+                                            self._managed,
+                                            entry)
+            self._track(entry, future)
+
+    def serve(self, host="127.0.0.1", port=0, entries=None, capacity=10000, max_bytes=16 * 2 ** 20):
+        """Starts a local HTTP server giving live access to the pushed data.
+
+        From then on, the records pushed in the served entries are serialized to json when pushed, and the last
+        `capacity` of them are kept in memory, within `max_bytes` bytes per entry. As serializing large values (images,
+        videos ...) at every push is costly, consider only serving the scalar entries. The server lists the entries
+        at `/entries`, and returns the records of an entry pushed since a cursor at
+        `/tail?entry=<entry>&cursor=<cursor>&timeout=<seconds>`, as newline delimited json. The request is held until
+        a record is pushed or the timeout expires, and the next cursor is given in the `X-Cursor` header.
+
+        :param string host: Address to bind. Defaults to the loopback interface.
+        :param int port: Port to bind. If 0, a free port is picked.
+        :param List[string] or None entries: Names of the entries to serve. If `None`, all the entries.
+        :param int capacity: Number of records kept per entry.
+        :param int max_bytes: Size of the records kept per entry, in bytes.
+        :return: The address of the server.
+        :rtype: Tuple[string, int]
+        """
+        self._check_open()
+        if self._server is not None:
+            raise Exception("You tried to serve a logger that is already served.")
+        self._tail = LiveTail(capacity, max_bytes, entries)
+        for entry in self._managed.entries:
+            self._tail.declare(entry)
+        self._server = serve_live_tail(self._tail, host, port)
+        logging.getLogger("datalogger").info(f"{self._managed.name} DataLogger: Serving at {self._server.server_address}.")
+        return self._server.server_address
+
+    def stop_serving(self):
+        """Stops the server started with `serve`, and drops the records kept in memory."""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+        self._server = None
+        self._tail = None
 
     def get_entry_length(self, entry):
         """Retrieves the number of data saved for a log entry.
@@ -233,6 +349,7 @@ class DataLogger(metaclass=Singleton):
         :return: Number of data pieces in the entry storage
         :rtype: int
         """
+        self._check_open()
         return self._managed.counters[entry]
 
     def get_serie(self, entry):
@@ -242,19 +359,110 @@ class DataLogger(metaclass=Singleton):
         :return: Serie of data ordered by key
         :rtype: List[any]
         """
+        self._check_open()
         return [i[1] for i in sorted(self._managed.data[entry].items())]
 
+    def flush(self, entries=None, timeout=None):
+        """Wait for the handling of some entries to be completed.
+
+        Only the `push`, `dump` and `reset` calls made on the given entries are waited for, which allows to wait for a
+        light entry without waiting for the heavy handlers of the others. Note that the calls are still handled in
+        submission order by the executor: with the default single worker (see `DataLogger.set_pool`), a call queued
+        behind a heavy one waits for it anyway.
+
+        :param List[string] or None entries: Names of the log entries to wait for. If `None`, all the entries.
+        :param float or None timeout: Maximum time to wait, in seconds. If `None`, waits until completion.
+        :return: Names of the entries whose handling is still pending.
+        :rtype: List[string]
+        """
+        if entries is None:
+            entries = list(self._pending.keys())
+        futures = [f for entry in entries for f in self._pending.get(entry, set()).copy()]
+        _, not_done = wait(futures, timeout=timeout)
+        return [entry for entry in entries if not self._pending.get(entry, set()).isdisjoint(not_done)]
+
     def wait(self, log_durations=True):
         """Wait for the handling queue to be emptied.
 
+        Only the calls made on this namespace are waited for. In particular, waiting on the data logger does not wait
+        for the namespaces created with `namespace`.
+
         :param bool log_durations: Whether to log the wait duration.
         """
         # Using a Lock with timeout to wait allows to see it on concurrency diagrams.
         b = datetime.datetime.now()
         with Lock() as l:
-            wait(self._futures)
-        self._futures.clear()
+            self.flush()
         if log_durations:
             logging.getLogger("datalogger").info(f"{self._managed.name} DataLogger: Last wait occured {b - self._tick} ago.")
             logging.getLogger("datalogger").info(f"{self._managed.name} DataLogger: Waited {datetime.datetime.now() - b} for completion.")
         self._tick = datetime.datetime.now()
+
+
+###############
+# DATA LOGGER #
+###############
+class DataLogger(LoggerNamespace, metaclass=Singleton):
+    """Stores and save various type of data under various forms.
+
+    The data logger is itself the default namespace. It owns the executor and the storage backend, which are shared
+    with the namespaces created with `namespace`.
+    """
+
+    def __init__(self):
+        # Shared resources, created before the default namespace uses them.
+        self._manager = Manager()
+        self._pool = ThreadPoolExecutor(max_workers=1)
+        self._namespaces = dict()
+        super(DataLogger, self).__init__()
+
+    def set_pool(self, pool, n_par=5):
+        """Sets the executor to be used to call handlers.
+
+        :param string pool: The type of executor to use to call handlers. Either "thread" or "process".
+        :param int n_par: The number of executor to use.
+        """
+        if any(len(n._managed.lockers) != 0 for n in [self] + list(self._namespaces.values())):
+            raise Exception("You tried to pool after having registered some entries.")
+        if pool == "thread":
+            self._pool = ThreadPoolExecutor(max_workers=n_par)
+        elif pool == "process":
+            self._pool = ProcessPoolExecutor(max_workers=n_par)
+        else:
+            raise Exception(f"Unknown pool type `{pool}`")
+
+    def namespace(self, name, path=None):
+        """Returns a logger namespace, creating it at first call.
+
+        A namespace has its own name, path and entries, and offers the same methods as the data logger, but shares its
+        executor and storage backend. This allows to create many short-lived loggers without multiplying workers.
+
+        :param string name: Name of the namespace.
+        :param string or None path: Root path of the namespace. If `None`, a `name` subfolder of the logger path.
+        :return: The logger namespace.
+        :rtype: LoggerNamespace
+        """
+        if name not in self._namespaces:
+            if path is None:
+                path = os.path.join(self.get_path(), name)
+            self._namespaces[name] = LoggerNamespace(name, path, root=self)
+        return self._namespaces[name]
+
+    def close_namespace(self, name):
+        """Waits for the handling of a namespace to be completed, stops its live tail server if any, and releases its
+        entries. The namespace can not be used afterwards.
+
+        The state kept by the image handlers for the namespace path is dropped as well, in the current process only.
+        Processes of a process based pool evict it on their own, past a fixed number of paths.
+
+        :param string name: Name of the namespace.
+        """
+        namespace = self._namespaces.pop(name)
+        namespace.wait(log_durations=False)
+        namespace.stop_serving()
+        namespace._closed = True
+        clear_image_caches(namespace.get_path())
+        namespace._managed.entries[:] = []
+        for attribute in ["data", "lockers", "counters", "on_push_callables", "on_reset_callables",
+                          "on_dump_callables"]:
+            getattr(namespace._managed, attribute).clear()
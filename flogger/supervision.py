@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+This module contains a wrapper to supervise the execution of handlers. A supervised handler can be run in an isolated
+process that is killed and restarted when it exceeds a timeout, and be disabled after repeated failures.
+"""
+###########
+# IMPORTS #
+###########
+import os
+import uuid
+import threading
+import logging
+import multiprocessing
+from .handlers import _remove_temporary_files
+
+
+####################
+# ISOLATED WORKERS #
+####################
+def _isolated_loop(conn):
+    """Loop of an isolated worker, calling the handlers received through the pipe."""
+    while True:
+        handler, entry, data, kwargs = conn.recv()
+        try:
+            handler(entry, data, **kwargs)
+            conn.send((True, None))
+        except Exception as e:
+            conn.send((False, e))
+
+
+class _IsolatedWorker(object):
+    """A process dedicated to a handler and an entry, started at first call and restarted after it was killed."""
+
+    def __init__(self):
+        self._process = None
+        self._conn = None
+        # Calls from different executor threads must not interleave on the pipe.
+        self._lock = threading.Lock()
+
+    def call(self, handler, entry, data, timeout, **kwargs):
+        with self._lock:
+            self._call(handler, entry, data, timeout, **kwargs)
+
+    def _call(self, handler, entry, data, timeout, **kwargs):
+        if self._process is None or not self._process.is_alive():
+            self._conn, child_conn = multiprocessing.Pipe()
+            self._process = multiprocessing.Process(target=_isolated_loop, args=(child_conn,), daemon=True)
+            self._process.start()
+        self._conn.send((handler, entry, data, kwargs))
+        if not self._conn.poll(timeout):
+            pid = self._process.pid
+            self.kill()
+            # The killed worker may have left the temporary files of the file writing handlers behind.
+            path = os.path.join(kwargs.get("path", "."), entry)
+            for directory in [os.path.dirname(path) or ".", path]:
+                _remove_temporary_files(directory, pid)
+            raise TimeoutError(f"Handler {handler} did not complete in {timeout}s, its worker was killed.")
+        success, exception = self._conn.recv()
+        if not success:
+            raise exception
+
+    def kill(self):
+        # Process.kill only exists from python 3.7.
+        getattr(self._process, "kill", self._process.terminate)()
+        self._process.join()
+        self._conn.close()
+        self._process = None
+        self._conn = None
+
+
+# Isolated workers and numbers of consecutive failures of the current process, by supervised handler and entry.
+_workers = {}
+_failures = {}
+
+
+##############
+# SUPERVISED #
+##############
+class Supervised(object):
+    """Wraps a handler to supervise its execution. Can be used anywhere a handler is expected.
+
+    If `isolated` is set, the handler runs in a dedicated process. If it does not complete in `timeout` seconds, the
+    process is killed, which releases the entry, and the call fails with a `TimeoutError`. A new process is started at
+    next call. If `max_failures` is set, the handler is no longer called after as many consecutive failures.
+
+    Isolated processes and failures are per entry: a supervised handler declared on several entries has a process for
+    each, and failing on one entry does not disable it on the others. Failures are counted in the process running the
+    handler. With a process based pool, each worker disables the handler on its own.
+
+    :param handler handler: The handler to supervise.
+    :param float or None timeout: Maximum duration of a call, in seconds. Requires `isolated`.
+    :param bool isolated: Whether to run the handler in an isolated process.
+    :param int or None max_failures: Number of consecutive failures after which the handler is disabled.
+    """
+
+    def __init__(self, handler, timeout=None, isolated=False, max_failures=None):
+        assert timeout is None or isolated, "A timeout can only be set on an isolated handler."
+        assert max_failures is None or max_failures >= 1, f"Max failures {max_failures} must be at least 1."
+        self.handler = handler
+        self.timeout = timeout
+        self.isolated = isolated
+        self.max_failures = max_failures
+        # Identifies the state of the handler across pickling.
+        self._key = uuid.uuid4().hex
+
+    def __repr__(self):
+        return f"Supervised({self.handler!r})"
+
+    def __call__(self, entry, data, **kwargs):
+        key = (self._key, entry)
+        failures = _failures.get(key, 0)
+        if self.max_failures is not None and failures >= self.max_failures:
+            return
+        try:
+            if self.isolated:
+                worker = _workers.setdefault(key, _IsolatedWorker())
+                worker.call(self.handler, entry, data.copy(), self.timeout, **kwargs)
+            else:
+                self.handler(entry, data, **kwargs)
+        except Exception:
+            _failures[key] = failures + 1
+            if self.max_failures is not None and failures + 1 >= self.max_failures:
+                logging.getLogger("datalogger").error(f"{self} of {entry} disabled after {self.max_failures} "
+                                                      f"consecutive failures.")
+            raise
+        if failures != 0:
+            _failures[key] = 0
@@ -26,6 +26,12 @@ if __name__ == "__main__":
               [],
               [])
     a.push("Gif", np.random.randint(0, 255, (50, 1, 40, 40)).astype(np.uint8), 1)
+    a.declare("Samples",
+              [fl.save_to_montage, fl.save_to_images],
+              [],
+              [])
+    for i in range(20):
+        a.push("Samples", np.random.randint(0, 255, (3, 40, 40)).astype(np.uint8), i)
     a.wait()
     for i in range(100):
         a.push("Loss", np.random.randn(), i)
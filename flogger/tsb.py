@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+This module contains a minimal tensorboard event file writer for scalars. It hand-encodes the few protobuf fields of
+scalar summaries, and frames them as tensorboard records, which avoids importing tensorboardX and protobuf in processes
+that only log metrics.
+"""
+###########
+# IMPORTS #
+###########
+import os
+import math
+import socket
+import threading
+from multiprocessing.util import Finalize
+import struct
+import time
+
+
+#########
+# CRC32 #
+#########
+def _make_crc32c_table():
+    """Builds the lookup table of the CRC32C (Castagnoli) checksum."""
+    table = []
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0x82f63b78 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+
+_CRC32C_TABLE = _make_crc32c_table()
+
+
+def _masked_crc32c(data):
+    """Returns the masked CRC32C checksum of some bytes, as expected by tensorboard records."""
+    crc = 0xffffffff
+    for byte in data:
+        crc = _CRC32C_TABLE[(crc ^ byte) & 0xff] ^ (crc >> 8)
+    crc ^= 0xffffffff
+    return (((crc >> 15) | (crc << 17)) + 0xa282ead8) & 0xffffffff
+
+
+############
+# ENCODING #
+############
+def _encode_varint(value):
+    """Encodes an integer as a protobuf varint. Negative values are encoded as 64 bits two's complement."""
+    if value < 0:
+        value += 1 << 64
+    out = bytearray()
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _encode_record(data):
+    """Frames an encoded event as a tensorboard record."""
+    header = struct.pack("<Q", len(data))
+    return header + struct.pack("<I", _masked_crc32c(header)) + data + struct.pack("<I", _masked_crc32c(data))
+
+
+def _encode_version_event(wall_time):
+    """Encodes the event that opens every event file."""
+    version = b"brain.Event:2"
+    return b"\x09" + struct.pack("<d", wall_time) + b"\x1a" + _encode_varint(len(version)) + version
+
+
+def _encode_scalar_event(tag, step, value, wall_time):
+    """Encodes an event holding a single scalar summary."""
+    tag = tag.encode("utf-8")
+    value = float(value)
+    try:
+        packed = struct.pack("<f", value)
+    except OverflowError:
+        # Finite values beyond the float32 range are written as infinite, as tensorboardX does.
+        packed = struct.pack("<f", math.copysign(math.inf, value))
+    summary_value = b"\x0a" + _encode_varint(len(tag)) + tag + b"\x15" + packed
+    summary = b"\x0a" + _encode_varint(len(summary_value)) + summary_value
+    return (b"\x09" + struct.pack("<d", wall_time) + b"\x10" + _encode_varint(int(step))
+            + b"\x2a" + _encode_varint(len(summary)) + summary)
+
+
+##########
+# WRITER #
+##########
+class EventFileWriter(object):
+    """Appends scalar events to the event file of a directory.
+
+    A single event file, recognizable by its `.flogger` suffix, is used per directory. It is created at first write if
+    none exists yet, and reopened in append mode at every write, so that several processes can share it.
+
+    Scalars are buffered, and written together once `max_pending` of them are buffered, or once the oldest of them is
+    older than `max_delay` seconds when a new one is added. Call `flush` to write them right away.
+
+    :param string log_dir: Directory of the event file.
+    :param int max_pending: Number of buffered scalars that triggers a write.
+    :param float max_delay: Age of the oldest buffered scalar that triggers a write, in seconds.
+    """
+
+    def __init__(self, log_dir, max_pending=100, max_delay=1.):
+        self.log_dir = log_dir
+        self.max_pending = max_pending
+        self.max_delay = max_delay
+        self.filename = None
+        self._buffer = []
+        self._first = None
+        self._lock = threading.Lock()
+
+    def _get_filename(self):
+        """Returns the event file of the directory, creating it if needed."""
+        if self.filename is None:
+            os.makedirs(self.log_dir, exist_ok=True)
+            existing = sorted(f for f in os.listdir(self.log_dir) if f.endswith(".flogger"))
+            if existing:
+                self.filename = os.path.join(self.log_dir, existing[0])
+            else:
+                wall_time = time.time()
+                self.filename = os.path.join(self.log_dir, "events.out.tfevents.{}.{}.flogger".format(
+                    int(wall_time), socket.gethostname()))
+                with open(self.filename, "ab") as fp:
+                    fp.write(_encode_record(_encode_version_event(wall_time)))
+        return self.filename
+
+    def add_scalars(self, records):
+        """Adds many scalars to the buffer, and writes the buffer if it is full or too old.
+
+        :param List[Tuple[string, int, float]] records: The `(tag, step, value)` scalars to append.
+        """
+        wall_time = time.time()
+        encoded = [_encode_record(_encode_scalar_event(tag, step, value, wall_time)) for tag, step, value in records]
+        with self._lock:
+            if self._first is None:
+                self._first = wall_time
+            self._buffer.extend(encoded)
+            if len(self._buffer) >= self.max_pending or wall_time - self._first >= self.max_delay:
+                self._write()
+
+    def add_scalar(self, tag, value, step):
+        """Adds a scalar to the buffer, and writes the buffer if it is full or too old.
+
+        :param string tag: Tag of the scalar.
+        :param float value: Value of the scalar.
+        :param int step: Step of the scalar.
+        """
+        self.add_scalars([(tag, step, value)])
+
+    def flush(self):
+        """Writes the buffered scalars to the event file."""
+        with self._lock:
+            self._write()
+
+    def _write(self):
+        """Writes the buffer in a single write. Must be called with the lock held."""
+        if self._buffer:
+            with open(self._get_filename(), "ab") as fp:
+                fp.write(b"".join(self._buffer))
+        self._buffer = []
+        self._first = None
+
+
+_writers = {}
+# Process in which the writers are flushed at exit.
+_flushed_pid = None
+
+
+def get_event_file_writer(log_dir):
+    """Returns the event file writer of a directory, reusing the one of previous calls in the same process.
+
+    :param string log_dir: Directory of the event file.
+    :return: The writer of the directory.
+    :rtype: EventFileWriter
+    """
+    global _flushed_pid
+    if _flushed_pid != os.getpid():
+        # Child processes start with an empty finalizer registry, hence the registration in every process. Unlike
+        # atexit, multiprocessing finalizers also run at the exit of child processes.
+        _flushed_pid = os.getpid()
+        Finalize(None, flush_event_files, exitpriority=10)
+    writer = _writers.get(log_dir)
+    if writer is None:
+        writer = _writers.setdefault(log_dir, EventFileWriter(log_dir))
+    return writer
+
+
+def flush_event_files():
+    """Writes the scalars buffered by the writers of the current process. Called at exit, including in the workers of
+    a process pool."""
+    for writer in list(_writers.values()):
+        writer.flush()
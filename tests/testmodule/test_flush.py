@@ -0,0 +1,25 @@
+import time
+import flogger as fl
+
+
+def slow(entry, data, **kwargs):
+    time.sleep(1.)
+
+
+def test_flush(tmp_path):
+    logger = fl.DataLogger()
+    logger.set_pool("thread", 2)
+    trial = logger.namespace("flush", path=str(tmp_path))
+    trial.declare("slow", [slow], [], [])
+    trial.declare("fast", [], [], [])
+    trial.push("slow", 0, 0)
+    trial.push("fast", 0, 0)
+    start = time.time()
+    assert trial.flush(["fast"], timeout=0.5) == []
+    assert time.time() - start < 0.5
+    assert trial.flush(timeout=0.1) == ["slow"]
+    assert trial.flush(timeout=5.) == []
+    # Done callbacks run right after the waiters are woken up.
+    time.sleep(0.1)
+    assert all(len(pending) == 0 for pending in trial._pending.values())
+    logger.close_namespace("flush")
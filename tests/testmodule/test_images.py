@@ -0,0 +1,48 @@
+import os
+import imageio.v2 as imageio
+import numpy as np
+import pytest
+import flogger as fl
+
+
+def tiles(value, n=4, shape=(3, 4, 4)):
+    return {i: np.full(shape, value, dtype=np.uint8) for i in range(n)}
+
+
+def test_montage_overwritten_keys(tmp_path):
+    path = str(tmp_path)
+    fl.save_to_montage("M", tiles(0), ncols=2, path=path)
+    assert imageio.imread(os.path.join(path, "M.png")).max() == 0
+    # Pushing again to the same keys, or resetting then refilling them, changes the values only.
+    data = tiles(0)
+    data[1] = np.full((3, 4, 4), 255, dtype=np.uint8)
+    fl.save_to_montage("M", data, ncols=2, path=path)
+    montage = imageio.imread(os.path.join(path, "M.png"))
+    assert montage.shape == (8, 8, 3)
+    assert montage[:4, 4:].min() == 255 and montage[:4, :4].max() == 0
+    fl.save_to_montage("M", {0: np.full((3, 4, 4), 255, dtype=np.uint8)}, ncols=2, path=path)
+    assert imageio.imread(os.path.join(path, "M.png")).shape == (4, 4, 3)
+    fl.save_to_montage("M", tiles(255), ncols=2, path=path)
+    assert imageio.imread(os.path.join(path, "M.png")).min() == 255
+
+
+def test_montage_shapes(tmp_path):
+    path = str(tmp_path)
+    fl.save_to_montage("M", tiles(0), ncols=2, path=path)
+    # A new shape for all images rebuilds the montage, a single odd image raises.
+    fl.save_to_montage("M", tiles(9, shape=(3, 8, 8)), ncols=2, path=path)
+    assert imageio.imread(os.path.join(path, "M.png")).shape == (16, 16, 3)
+    with pytest.raises(Exception, match="shape"):
+        fl.save_to_montage("M", {0: np.zeros((3, 8, 8), np.uint8), 1: np.zeros((3, 4, 4), np.uint8)}, ncols=2,
+                           path=path)
+
+
+def test_images_overwritten_keys(tmp_path):
+    path = str(tmp_path)
+    fl.save_to_images("I", tiles(0), path=path)
+    fl.save_to_images("I", tiles(255, n=2), path=path)
+    assert imageio.imread(os.path.join(path, "I", "0.png")).min() == 255
+    assert imageio.imread(os.path.join(path, "I", "3.png")).max() == 0
+    mtime = os.stat(os.path.join(path, "I", "0.png")).st_mtime_ns
+    fl.save_to_images("I", tiles(255, n=2), path=path)
+    assert os.stat(os.path.join(path, "I", "0.png")).st_mtime_ns == mtime
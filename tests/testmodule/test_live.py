@@ -0,0 +1,82 @@
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+import numpy as np
+import pytest
+from flogger.live import LiveTail, serve_live_tail
+
+
+def records(lines):
+    return [json.loads(line) for line in lines]
+
+
+def test_cursors():
+    tail = LiveTail(capacity=3)
+    tail.declare("Loss")
+    for i in range(5):
+        tail.append("Loss", i, i * 10)
+    assert tail.entries() == {"Loss": 5}
+    # Only the last 3 records are kept.
+    lines, cursor = tail.since("Loss", 0)
+    assert records(lines) == [{"cursor": c, "time": c, "value": c * 10} for c in [2, 3, 4]]
+    assert cursor == 5
+    lines, cursor = tail.since("Loss", 4)
+    assert records(lines) == [{"cursor": 4, "time": 4, "value": 40}]
+    assert tail.since("Loss", 5) == ([], 5)
+
+
+def test_serialized_on_append():
+    tail = LiveTail(max_bytes=200, entries=["Images"])
+    tail.declare("Images")
+    tail.declare("Ignored")
+    value = np.zeros(4)
+    tail.append("Images", 0, value)
+    tail.append("Ignored", 0, value)
+    value[:] = 1
+    assert tail.entries() == {"Images": 1}
+    assert records(tail.since("Images", 0)[0])[0]["value"] == [0, 0, 0, 0]
+    # Large records are evicted to stay within max_bytes, but the last one is kept.
+    for i in range(1, 4):
+        tail.append("Images", i, np.zeros(30))
+    lines, cursor = tail.since("Images", 0)
+    assert [r["cursor"] for r in records(lines)] == [3]
+    assert cursor == 4
+
+
+def test_long_poll():
+    tail = LiveTail()
+    tail.declare("Loss")
+    timer = threading.Timer(0.2, tail.append, ("Loss", 0, 1.))
+    timer.start()
+    start = time.time()
+    lines, cursor = tail.since("Loss", 0, timeout=5.)
+    assert records(lines) == [{"cursor": 0, "time": 0, "value": 1.}]
+    assert cursor == 1
+    assert time.time() - start < 4.
+    start = time.time()
+    assert tail.since("Loss", 1, timeout=0.2) == ([], 1)
+    assert time.time() - start >= 0.2
+
+
+def test_server():
+    tail = LiveTail()
+    tail.declare("A/Loss")
+    tail.append("A/Loss", 0, 1.5)
+    tail.append("A/Loss", 1, 2.5)
+    server = serve_live_tail(tail)
+    try:
+        base = "http://{}:{}".format(*server.server_address)
+        assert json.loads(urllib.request.urlopen(base + "/entries").read()) == {"A/Loss": 2}
+        response = urllib.request.urlopen(base + "/tail?entry=A/Loss&cursor=1")
+        assert response.headers["X-Cursor"] == "2"
+        lines = response.read().decode("utf-8").splitlines()
+        assert [json.loads(line) for line in lines] == [{"cursor": 1, "time": 1, "value": 2.5}]
+        for timeout in ["nan", "inf", "-1", "abc"]:
+            with pytest.raises(urllib.error.HTTPError) as error:
+                urllib.request.urlopen(base + "/tail?entry=A/Loss&cursor=2&timeout=" + timeout)
+            assert error.value.code == 400
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,21 @@
+import pytest
+import flogger as fl
+
+
+def test_namespaces(tmp_path):
+    logger = fl.DataLogger()
+    trial = logger.namespace("trial-a", path=str(tmp_path / "a"))
+    assert logger.namespace("trial-a") is trial
+    trial.declare("Loss", [], [], [])
+    for i in range(3):
+        trial.push("Loss", i * 2, i)
+    trial.wait(log_durations=False)
+    assert trial.get_serie("Loss") == [0, 2, 4]
+    trial.serve()
+    server = trial._server
+    logger.close_namespace("trial-a")
+    assert trial._server is None
+    with pytest.raises(OSError):
+        server.socket.getsockname()
+    with pytest.raises(Exception, match="closed"):
+        trial.push("Loss", 6, 3)
@@ -0,0 +1,30 @@
+import flogger.logger
+from flogger.logger import SamplingPolicy
+
+
+def test_every():
+    policy = SamplingPolicy(every=3)
+    assert [i for i in range(10) if policy.accept()] == [0, 3, 6, 9]
+
+
+def test_max_rate(monkeypatch):
+    now = [100.]
+    monkeypatch.setattr(flogger.logger.time, "monotonic", lambda: now[0])
+    policy = SamplingPolicy(max_rate=2.)
+    assert policy.accept()
+    assert not policy.accept()
+    now[0] += 0.4
+    assert not policy.accept()
+    now[0] += 0.1
+    assert policy.accept()
+    assert not policy.accept()
+
+
+def test_probability():
+    assert not any(SamplingPolicy(probability=0.).accept() for _ in range(100))
+    assert all(SamplingPolicy(probability=1.).accept() for _ in range(100))
+
+
+def test_combined():
+    policy = SamplingPolicy(every=2, probability=1.)
+    assert [policy.accept() for _ in range(4)] == [True, False, True, False]
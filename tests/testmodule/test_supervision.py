@@ -0,0 +1,104 @@
+import os
+import time
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+import flogger as fl
+from flogger import supervision
+
+
+def fail(entry, data, **kwargs):
+    raise ValueError("fail")
+
+
+def hang_once(entry, data, path=".", **kwargs):
+    """Hangs at first call, leaving a temporary file behind, and writes its pid afterwards."""
+    marker = os.path.join(path, "hanged")
+    if not os.path.exists(marker):
+        open(marker, "w").close()
+        open(os.path.join(path, ".{}.{}-0.tmp.json".format(entry, os.getpid())), "w").close()
+        time.sleep(100)
+    with open(os.path.join(path, "pid"), "w") as fp:
+        fp.write(str(os.getpid()))
+
+
+def test_max_failures():
+    calls = []
+
+    def handler(entry, data, **kwargs):
+        calls.append(len(data))
+        raise ValueError("fail")
+
+    supervised = fl.Supervised(handler, max_failures=2)
+    for i in range(2):
+        with pytest.raises(ValueError):
+            supervised("Loss", {0: 1})
+    supervised("Loss", {0: 1})
+    assert len(calls) == 2
+
+
+def test_failures_reset_on_success():
+    outcomes = [False, True, False, False]
+
+    def handler(entry, data, **kwargs):
+        if not outcomes.pop(0):
+            raise ValueError("fail")
+
+    supervised = fl.Supervised(handler, max_failures=2)
+    for _ in range(4):
+        try:
+            supervised("Loss", {0: 1})
+        except ValueError:
+            pass
+    assert outcomes == []
+
+
+def test_timeout_requires_isolation():
+    with pytest.raises(AssertionError):
+        fl.Supervised(fail, timeout=1.)
+
+
+def test_isolated_timeout(tmp_path):
+    supervised = fl.Supervised(hang_once, timeout=1., isolated=True)
+    with pytest.raises(TimeoutError):
+        supervised("Loss", {0: 1}, path=str(tmp_path))
+    assert [name for name in os.listdir(str(tmp_path)) if name.startswith(".")] == []
+    supervised("Loss", {0: 1}, path=str(tmp_path))
+    with open(os.path.join(str(tmp_path), "pid")) as fp:
+        pid = int(fp.read())
+    assert pid not in [os.getpid(), None]
+    assert supervision._workers[(supervised._key, "Loss")]._process.pid == pid
+    supervision._workers.pop((supervised._key, "Loss")).kill()
+
+
+def fail_on_a(entry, data, **kwargs):
+    time.sleep(0.1)
+    if entry == "A":
+        raise ValueError("{} failed".format(entry))
+
+
+def test_isolated_entries():
+    supervised = fl.Supervised(fail_on_a, timeout=10., isolated=True, max_failures=1)
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        for _ in range(3):
+            futures = {entry: pool.submit(supervised, entry, {0: 1}) for entry in ["A", "B"]}
+            with pytest.raises(ValueError, match="A failed"):
+                futures["A"].result()
+            assert futures["B"].result() is None
+            # Failing on A only disables the handler for A.
+            assert supervised("A", {0: 1}) is None
+            supervision._failures.pop((supervised._key, "A"))
+    for entry in ["A", "B"]:
+        supervision._workers.pop((supervised._key, entry)).kill()
+
+
+def test_shared_worker_calls_do_not_interleave():
+    worker = supervision._IsolatedWorker()
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        futures = [(entry, pool.submit(worker.call, fail_on_a, entry, {0: 1}, 10.)) for entry in ["A", "B"] * 3]
+        for entry, future in futures:
+            if entry == "A":
+                with pytest.raises(ValueError, match="A failed"):
+                    future.result()
+            else:
+                assert future.result() is None
+    worker.kill()
@@ -0,0 +1,53 @@
+import glob
+import math
+import os
+import struct
+import pytest
+from flogger.tsb import EventFileWriter
+
+event_pb2 = pytest.importorskip("tensorboardX.proto.event_pb2")
+record_writer = pytest.importorskip("tensorboardX.record_writer")
+
+
+def read_events(filename):
+    """Reads the events of a file, checking the framing of every record."""
+    with open(filename, "rb") as fp:
+        content = fp.read()
+    events = []
+    offset = 0
+    while offset < len(content):
+        header = content[offset:offset + 8]
+        length, = struct.unpack("<Q", header)
+        assert struct.unpack("<I", content[offset + 8:offset + 12])[0] == record_writer.masked_crc32c(header)
+        data = content[offset + 12:offset + 12 + length]
+        assert struct.unpack("<I", content[offset + 12 + length:offset + 16 + length])[0] == \
+            record_writer.masked_crc32c(data)
+        event = event_pb2.Event()
+        event.ParseFromString(data)
+        events.append(event)
+        offset += 16 + length
+    return events
+
+
+def test_round_trip(tmp_path):
+    writer = EventFileWriter(str(tmp_path))
+    writer.add_scalars([("loss", 0, 1.5), ("loss", -1, 2.), ("acc", 2 ** 40, 1e39)])
+    writer.add_scalar("loss", -1e39, 3)
+    assert glob.glob(os.path.join(str(tmp_path), "*.flogger")) == []
+    writer.flush()
+    files = glob.glob(os.path.join(str(tmp_path), "*tfevents*.flogger"))
+    assert len(files) == 1
+    events = read_events(files[0])
+    assert events[0].file_version == "brain.Event:2"
+    scalars = [(e.summary.value[0].tag, e.step, e.summary.value[0].simple_value) for e in events[1:]]
+    assert scalars == [("loss", 0, 1.5), ("loss", -1, 2.), ("acc", 2 ** 40, math.inf), ("loss", 3, -math.inf)]
+
+
+def test_batching(tmp_path):
+    writer = EventFileWriter(str(tmp_path), max_pending=3, max_delay=1000.)
+    writer.add_scalar("loss", 0., 0)
+    writer.add_scalar("loss", 1., 1)
+    assert glob.glob(os.path.join(str(tmp_path), "*.flogger")) == []
+    writer.add_scalar("loss", 2., 2)
+    events = read_events(glob.glob(os.path.join(str(tmp_path), "*.flogger"))[0])
+    assert [e.step for e in events[1:]] == [0, 1, 2]